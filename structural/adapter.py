@@ -19,6 +19,8 @@ from abc import (
     ABC,
     abstractmethod,
 )
+from array import array
+from typing import Iterable
 
 
 class IOven(ABC):
@@ -83,6 +85,8 @@ class OvenAdapter(ICelsiusOven):
     CELSIUS_TO_FAHRENHEIT: float = 9.0 / 5.0
     FAHRENHEIT_TO_CELSIUS: float = 5.0 / 9.0
     FAHRENHEIT_ZERO: float = 32.0
+    # нижняя граница температуры плиты
+    MIN_FAHRENHEIT: float = 32.0
 
     def __init__(self, original_stove: IOven):
         self.stove = original_stove
@@ -106,6 +110,48 @@ class OvenAdapter(ICelsiusOven):
         self.stove.set_temperature(new_temperature_stove)
         self.temperature = t
 
+    @classmethod
+    def to_celsius_batch(cls, temperatures: Iterable[float]) -> array:
+        """
+        Переводит набор показаний плиты из F в C за один проход.
+        Принимает любой итерируемый набор чисел, в том числе array('d')
+        или memoryview с форматом 'd'. Нижняя граница проверяется один раз
+        для всего набора, при нарушении или NaN возбуждается ValueError.
+        """
+        fahrenheit = array('d', temperatures)
+        cls._check_batch(
+            fahrenheit, cls.MIN_FAHRENHEIT, 'Мы тут не холодильник реализуем'
+        )
+        ratio = cls.FAHRENHEIT_TO_CELSIUS
+        zero = cls.FAHRENHEIT_ZERO
+        return array('d', [ratio * (t - zero) for t in fahrenheit])
+
+    @classmethod
+    def to_fahrenheit_batch(cls, temperatures: Iterable[float]) -> array:
+        """
+        Переводит набор температур из C в F за один проход.
+        Нижняя граница проверяется один раз для всего набора до перевода,
+        при нарушении или NaN возбуждается ValueError.
+        """
+        celsius = array('d', temperatures)
+        ratio = cls.CELSIUS_TO_FAHRENHEIT
+        zero = cls.FAHRENHEIT_ZERO
+        cls._check_batch(
+            celsius,
+            (cls.MIN_FAHRENHEIT - zero) / ratio,
+            'Печь которая может морозить? Хм... интересненько',
+        )
+        return array('d', [ratio * t + zero for t in celsius])
+
+    @staticmethod
+    def _check_batch(values: array, bound: float, message: str) -> None:
+        if not values:
+            return
+        # min() не замечает NaN не на первой позиции, а сумма с NaN - NaN
+        total = sum(values)
+        if not (min(values) >= bound and total == total):
+            raise ValueError(message)
+
 
 if __name__ == '__main__':
 
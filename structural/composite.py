@@ -35,6 +35,18 @@ from abc import (
     ABC,
     abstractmethod,
 )
+from array import array
+from collections import defaultdict
+from itertools import (
+    count,
+    islice,
+)
+from operator import mul
+from typing import (
+    Iterable,
+    Iterator,
+    NamedTuple,
+)
 
 
 class IProduct(ABC):
@@ -68,32 +80,326 @@ class Product(IProduct):
         return self.__name
 
 
+class ProductContainer:
+    """
+    Контейнер вложенных продуктов составного продукта.
+    Ведет себя как список продуктов: хранит каждое добавление отдельной
+    записью в порядке добавления, remove удаляет первое вхождение.
+    Записи адресуются номером добавления, а продукты и имена
+    проиндексированы, поэтому удаление и поиск по имени выполняются за
+    O(1). Доступ по позиции (products[i]) проходит записи по порядку.
+    """
+
+    def __init__(self):
+        self._entries = {}  # номер добавления -> продукт, по порядку
+        self._tokens = {}  # продукт -> номера его добавлений по порядку
+        self._counts = {}  # продукт -> кратность
+        self._by_name = {}  # имя -> продукты с этим именем
+        self._next_token = count()
+
+    def append(self, product: IProduct) -> None:
+        token = next(self._next_token)
+        self._entries[token] = product
+        tokens = self._tokens.get(product)
+        if tokens is None:
+            self._tokens[product] = [token]
+            self._counts[product] = 1
+            self._by_name.setdefault(product.name(), {})[product] = None
+        else:
+            tokens.append(token)
+            self._counts[product] += 1
+
+    def remove(self, product: IProduct) -> None:
+        tokens = self._tokens.get(product)
+        if tokens is None:
+            raise ValueError('Продукт не найден')
+        del self._entries[tokens.pop(0)]
+        if tokens:
+            self._counts[product] -= 1
+        else:
+            del self._tokens[product]
+            del self._counts[product]
+            name = product.name()
+            products = self._by_name[name]
+            del products[product]
+            if not products:
+                del self._by_name[name]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._tokens.clear()
+        self._counts.clear()
+        self._by_name.clear()
+
+    def count(self, product: IProduct) -> int:
+        return self._counts.get(product, 0)
+
+    def items(self):
+        """Пары (продукт, кратность) в порядке первого вхождения"""
+        return self._counts.items()
+
+    def find(self, name: str):
+        """Первый по порядку продукт с данным именем или None"""
+        products = self._by_name.get(name)
+        if not products:
+            return None
+        return min(products, key=lambda it: self._tokens[it][0])
+
+    def find_all(self, name: str) -> list:
+        """Все вхождения продуктов с данным именем по порядку"""
+        tokens = sorted(
+            token
+            for product in self._by_name.get(name, ())
+            for token in self._tokens[product]
+        )
+        return [self._entries[token] for token in tokens]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        size = len(self._entries)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError('Индекс продукта вне диапазона')
+        return next(islice(self._entries.values(), index, None))
+
+    def __contains__(self, product) -> bool:
+        return product in self._counts
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[IProduct]:
+        return iter(self._entries.values())
+
+    def __reversed__(self) -> Iterator[IProduct]:
+        return reversed(self._entries.values())
+
+
+class ProductContainerView:
+    """
+    Представление контейнера продуктов только для чтения.
+    Составной продукт отдает наружу его, а не сам контейнер: состав
+    меняется только через add_product, remove_product и clear, которые
+    сбрасывают кеш стоимости и обновляют индексы ингредиентов.
+    """
+
+    __slots__ = ('_container',)
+
+    def __init__(self, container: ProductContainer):
+        self._container = container
+
+    def count(self, product: IProduct) -> int:
+        return self._container.count(product)
+
+    def items(self):
+        """Пары (продукт, кратность) в порядке первого вхождения"""
+        return self._container.items()
+
+    def find(self, name: str):
+        """Первый по порядку продукт с данным именем или None"""
+        return self._container.find(name)
+
+    def find_all(self, name: str) -> list:
+        """Все вхождения продуктов с данным именем по порядку"""
+        return self._container.find_all(name)
+
+    def __getitem__(self, index):
+        return self._container[index]
+
+    def __contains__(self, product) -> bool:
+        return product in self._container
+
+    def __len__(self) -> int:
+        return len(self._container)
+
+    def __iter__(self) -> Iterator[IProduct]:
+        return iter(self._container)
+
+    def __reversed__(self) -> Iterator[IProduct]:
+        return reversed(self._container)
+
+
 class CompoundProduct(IProduct):
     """
-    Класс компонуемых продуктов
+    Класс компонуемых продуктов.
+    Стоимость кешируется и сбрасывается вверх по цепочке родителей
+    при изменении состава через add_product, remove_product и clear,
+    поэтому products доступен только для чтения.
+
+    Один составной продукт может входить в несколько других (например,
+    общее тесто для разных пицц), то есть продукты образуют
+    ациклический граф. Стоимость общего продукта считается один раз
+    и используется всеми родителями, циклы запрещены.
     """
 
+    # признак составного продукта, проверяется при обходе дерева вместо
+    # isinstance - проверка через ABCMeta заметно дороже
+    _compound = True
+
     def __init__(self, name: str):
         self.__name = name
-        self.products = []
+        self._products = ProductContainer()
+        self.__products_view = ProductContainerView(self._products)
+        # составные продукты, в которые входит данный продукт
+        self._parents = []
+        # закешированная стоимость, None - требуется пересчет
+        self._cost = None
+        # индексы ингредиентов, отслеживающие данный продукт
+        self._indexes = []
+        # число вхождений продукта в отслеживаемые индексами продукты
+        self._tracked = 0
 
     def cost(self):
-        cost = 0
-        for it in self.products:
-            cost += it.cost()
-        return cost
+        if self._cost is None:
+            self._update_costs()
+        return self._cost
 
     def name(self) -> str:
         return self.__name
 
+    @property
+    def products(self) -> ProductContainerView:
+        """Вложенные продукты, только для чтения"""
+        return self.__products_view
+
+    def breakdown(self) -> 'CostBreakdown':
+        """Разбивка стоимости по вложенным продуктам"""
+        return CostBreakdown(self)
+
+    def walk(self):
+        """
+        Обходит поддерево в глубину без рекурсии, возвращая пары
+        (продукт, глубина). Сам продукт имеет глубину 0.
+        """
+        stack = [(self, 0)]
+        while stack:
+            product, depth = stack.pop()
+            yield product, depth
+            if getattr(product, '_compound', False):
+                stack.extend(
+                    (it, depth + 1) for it in reversed(product._products)
+                )
+
+    def _update_costs(self):
+        """
+        Пересчитывает устаревшие стоимости поддерева с явным стеком вместо
+        рекурсии: стоимость составного продукта считается после того,
+        как посчитаны стоимости его составных детей.
+        """
+        stack = [(self, False)]
+        while stack:
+            product, children_ready = stack.pop()
+            if product._cost is not None:
+                continue
+            if children_ready:
+                # стоимости составных детей уже в кеше
+                cost = 0
+                for it, count in product._products.items():
+                    cost += it.cost() * count
+                product._cost = cost
+            else:
+                stack.append((product, True))
+                for it, _ in product._products.items():
+                    if getattr(it, '_compound', False) and it._cost is None:
+                        stack.append((it, False))
+
+    def _invalidate(self):
+        """
+        Сбрасывает кеш стоимости у продукта и всех его предков.
+        Если стоимость продукта уже сброшена, то и у предков она сброшена.
+        Исключение - подклассы с собственным cost(): они могут не заполнять
+        кеш, поэтому сброс проходит через них к предкам всегда.
+        """
+        stack = [self]
+        while stack:
+            product = stack.pop()
+            if (
+                product._cost is not None
+                or type(product).cost is not CompoundProduct.cost
+            ):
+                product._cost = None
+                stack.extend(product._parents)
+
+    def _creates_cycle(self, product: 'CompoundProduct') -> bool:
+        """
+        Проверяет, входит ли данный продукт в product, то есть образует ли
+        добавление product цикл. Поиск идет одновременно вверх по предкам
+        данного продукта и вниз по потомкам product и заканчивается, как
+        только один из обходов исчерпан.
+        """
+        if product is self:
+            return True
+        ancestors, descendants = [self], [product]
+        seen_ancestors, seen_descendants = {self}, {product}
+        while ancestors and descendants:
+            for parent in ancestors.pop()._parents:
+                if parent is product:
+                    return True
+                if parent not in seen_ancestors:
+                    seen_ancestors.add(parent)
+                    ancestors.append(parent)
+            for child, _ in descendants.pop()._products.items():
+                if child is self:
+                    return True
+                if (
+                    getattr(child, '_compound', False)
+                    and child not in seen_descendants
+                ):
+                    seen_descendants.add(child)
+                    descendants.append(child)
+        return False
+
     def add_product(self, product: IProduct):
-        self.products.append(product)
+        if getattr(product, '_compound', False):
+            if self._creates_cycle(product):
+                raise ValueError(
+                    f'Продукт {product.name()} уже содержит {self.name()}'
+                )
+            product._parents.append(self)
+        self._products.append(product)
+        self._invalidate()
+        if self._tracked:
+            self._update_indexes(product, 1)
 
     def remove_product(self, product: IProduct):
-        self.products.remove(product)
+        self._products.remove(product)
+        if getattr(product, '_compound', False):
+            product._parents.remove(self)
+        self._invalidate()
+        if self._tracked:
+            self._update_indexes(product, -1)
 
     def clear(self):
-        self.products = []
+        if self._tracked:
+            for it, count in list(self._products.items()):
+                self._update_indexes(it, -count)
+        for it in self._products:
+            if getattr(it, '_compound', False):
+                it._parents.remove(self)
+        self._products.clear()
+        self._invalidate()
+
+    def _update_indexes(self, product: IProduct, count: int):
+        """
+        Сообщает индексам ингредиентов о добавлении (count > 0) или
+        удалении (count < 0) вложенного продукта. Обходятся только
+        отслеживаемые предки данного продукта.
+        """
+        if getattr(product, '_compound', False):
+            IngredientIndex.add_tracked(product, self._tracked * count)
+        totals = IngredientIndex.leaf_totals(product)
+        stack = [(self, count)]
+        while stack:
+            it, multiplier = stack.pop()
+            for index in it._indexes:
+                index.apply(it, totals, multiplier)
+            stack.extend(
+                (parent, multiplier)
+                for parent in it._parents
+                if parent._tracked
+            )
 
 
 class Pizza(CompoundProduct):
@@ -104,14 +410,189 @@ class Pizza(CompoundProduct):
     def __init__(self, name: str):
         super(Pizza, self).__init__(name)
 
-    def cost(self):
-        cost = 0
-        for it in self.products:
-            cost_it = it.cost()
-            print(f'Стоимость {it.name()} = {cost_it} тугриков')
-            cost += cost_it
-        print(f'Стоимость пиццы {self.name()} = {cost} тугриков')
-        return cost
+
+class CostBreakdownItem(NamedTuple):
+    """Строка разбивки стоимости"""
+
+    name: str
+    cost: float
+    depth: int
+
+
+class CostBreakdown:
+    """
+    Разбивка стоимости составного продукта по всем вложенным продуктам.
+    Строки не хранятся, а строятся при каждом обходе разбивки.
+    """
+
+    def __init__(self, product: 'CompoundProduct'):
+        self.product = product
+
+    @property
+    def total(self) -> float:
+        return self.product.cost()
+
+    def __iter__(self) -> Iterator[CostBreakdownItem]:
+        for it, depth in self.product.walk():
+            yield CostBreakdownItem(it.name(), it.cost(), depth)
+
+
+class PricingPlan:
+    """
+    План расчета стоимости набора деревьев продуктов.
+    Цены всех листьев собираются в один массив prices, а каждое дерево
+    становится строкой разреженной матрицы (формат CSR): номера его
+    листьев и их кратности. После изменения цен стоимости всех деревьев
+    пересчитываются умножением матрицы на массив цен, без обхода деревьев.
+    План не меняет сами продукты, а хранит собственные цены листьев.
+    """
+
+    def __init__(self, products: Iterable[IProduct]):
+        self.products = list(products)
+        self.prices = array('d')
+        self._leaf_indexes = {}  # лист -> номер в prices
+        self._name_indexes = defaultdict(list)  # имя листа -> номера
+        self._row_offsets = array('L', [0])
+        self._columns = array('L')
+        self._weights = array('d')
+        for product in self.products:
+            self._add_row(product)
+
+    def _leaf_index(self, leaf: IProduct) -> int:
+        index = self._leaf_indexes.get(leaf)
+        if index is None:
+            index = self._leaf_indexes[leaf] = len(self.prices)
+            self.prices.append(leaf.cost())
+            self._name_indexes[leaf.name()].append(index)
+        return index
+
+    def _add_row(self, product: IProduct):
+        counts = defaultdict(int)  # номер листа -> кратность
+        stack = [product]
+        while stack:
+            it = stack.pop()
+            if getattr(it, '_compound', False):
+                stack.extend(it._products)
+            else:
+                counts[self._leaf_index(it)] += 1
+        self._columns.extend(counts.keys())
+        self._weights.extend(counts.values())
+        self._row_offsets.append(len(self._columns))
+
+    def set_price(self, name: str, cost: float) -> None:
+        """
+        Меняет цену всех листьев с данным именем.
+        Для имени, которого нет в плане, возбуждает KeyError.
+        """
+        indexes = self._name_indexes.get(name)
+        if indexes is None:
+            raise KeyError(name)
+        for index in indexes:
+            self.prices[index] = cost
+
+    def costs(self) -> array:
+        """Стоимости всех деревьев в порядке products"""
+        prices = self.prices.__getitem__
+        columns = self._columns
+        weights = self._weights
+        offsets = self._row_offsets
+        return array(
+            'd',
+            (
+                sum(
+                    map(
+                        mul,
+                        map(prices, columns[start:end]),
+                        weights[start:end],
+                    )
+                )
+                for start, end in zip(offsets, offsets[1:])
+            ),
+        )
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов по набору составных продуктов, например по всем
+    пиццам меню. Для каждого имени листового продукта хранит отслеживаемые
+    продукты, в которые он входит, с числом вхождений и суммарной
+    стоимостью. Индекс обновляется при любом изменении состава вложенных
+    продуктов, поэтому запрос по ингредиенту выполняется за время,
+    пропорциональное числу найденных продуктов, а не размеру меню.
+    """
+
+    def __init__(self):
+        self.products = {}  # отслеживаемые продукты в порядке добавления
+        # имя ингредиента -> {продукт: [число вхождений, стоимость]}
+        self._entries = defaultdict(dict)
+
+    @staticmethod
+    def leaf_totals(product: IProduct) -> dict:
+        """Число вхождений и стоимость листовых продуктов по именам"""
+        totals = {}
+        stack = [(product, 1)]
+        while stack:
+            it, multiplier = stack.pop()
+            if getattr(it, '_compound', False):
+                stack.extend(
+                    (child, multiplier * count)
+                    for child, count in it._products.items()
+                )
+            else:
+                total = totals.setdefault(it.name(), [0, 0])
+                total[0] += multiplier
+                total[1] += it.cost() * multiplier
+        return totals
+
+    @staticmethod
+    def add_tracked(product: CompoundProduct, count: int):
+        """Меняет число отслеживаемых вхождений составных продуктов"""
+        stack = [(product, count)]
+        while stack:
+            it, count = stack.pop()
+            it._tracked += count
+            stack.extend(
+                (child, count * multiplier)
+                for child, multiplier in it._products.items()
+                if getattr(child, '_compound', False)
+            )
+
+    def track(self, product: CompoundProduct) -> None:
+        if product in self.products:
+            return
+        self.products[product] = None
+        product._indexes.append(self)
+        self.add_tracked(product, 1)
+        self.apply(product, self.leaf_totals(product), 1)
+
+    def untrack(self, product: CompoundProduct) -> None:
+        del self.products[product]
+        product._indexes.remove(self)
+        self.add_tracked(product, -1)
+        self.apply(product, self.leaf_totals(product), -1)
+
+    def apply(self, product: CompoundProduct, totals: dict, count: int):
+        """Учитывает в индексе изменение состава продукта"""
+        for name, (occurrences, cost) in totals.items():
+            entries = self._entries[name]
+            entry = entries.setdefault(product, [0, 0])
+            entry[0] += occurrences * count
+            entry[1] += cost * count
+            if not entry[0]:
+                del entries[product]
+                if not entries:
+                    del self._entries[name]
+
+    def occurrences(self, name: str) -> dict:
+        """Отслеживаемые продукты с ингредиентом и число его вхождений"""
+        return {
+            product: entry[0]
+            for product, entry in self._entries.get(name, {}).items()
+        }
+
+    def total_cost(self, name: str) -> float:
+        """Суммарная стоимость ингредиента во всех отслеживаемых продуктах"""
+        return sum(entry[1] for entry in self._entries.get(name, {}).values())
 
 
 if __name__ == '__main__':
@@ -130,4 +611,8 @@ if __name__ == '__main__':
     pizza.add_product(dough)
     pizza.add_product(sauce)
     pizza.add_product(topping)
+    for item in pizza.breakdown():
+        if item.depth == 1:
+            print(f'Стоимость {item.name} = {item.cost} тугриков')
+    print(f'Стоимость пиццы {pizza.name()} = {pizza.cost()} тугриков')
     print(pizza.cost())
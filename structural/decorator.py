@@ -29,6 +29,14 @@ from abc import (
     ABC,
     abstractmethod,
 )
+from array import array
+from functools import lru_cache
+from typing import (
+    Iterable,
+    Optional,
+    Tuple,
+    Type,
+)
 
 
 class IPizzaBase(ABC):
@@ -36,6 +44,8 @@ class IPizzaBase(ABC):
     Интерфейс декорируемого объекта
     """
 
+    __slots__ = ()
+
     @abstractmethod
     def cost(self) -> float:
         pass
@@ -58,10 +68,23 @@ class IDecorator(IPizzaBase):
     Интерфейс декоратора
     """
 
+    __slots__ = ()
+
     @abstractmethod
     def name(self) -> str:
         pass
 
+    def wrapped(self) -> Optional[IPizzaBase]:
+        """Оборачиваемый объект или None, если декоратор его не раскрывает"""
+        return None
+
+    def affine(self) -> Optional[Tuple[float, float]]:
+        """
+        Пара (scale, offset), если стоимость равна
+        scale * (стоимость оборачиваемого объекта) + offset, иначе None
+        """
+        return None
+
 
 class PizzaMargarita(IDecorator):
     """
@@ -80,6 +103,12 @@ class PizzaMargarita(IDecorator):
     def name(self) -> str:
         return self.__name
 
+    def wrapped(self) -> IPizzaBase:
+        return self.__wrapped
+
+    def affine(self) -> Tuple[float, float]:
+        return 1.0, self.__cost
+
 
 class PizzaSalami(IDecorator):
     """
@@ -98,6 +127,262 @@ class PizzaSalami(IDecorator):
     def name(self) -> str:
         return self.__name
 
+    def wrapped(self) -> IPizzaBase:
+        return self.__wrapped
+
+    def affine(self) -> Tuple[float, float]:
+        return 2.0, self.__cost * 2
+
+
+@lru_cache(maxsize=None)
+def _affine_trusted(cls: type) -> bool:
+    """
+    Можно ли верить affine() объектов класса: cost() и affine() должны
+    быть определены в одном классе. Подкласс, переопределивший cost()
+    без affine() (например, со скидкой), унаследовал бы чужую свертку.
+    """
+    cost_owner = next(it for it in cls.__mro__ if 'cost' in vars(it))
+    affine_owner = next(it for it in cls.__mro__ if 'affine' in vars(it))
+    return cost_owner is affine_owner
+
+
+def _affine_step(pizza: IPizzaBase):
+    """Пара (affine, wrapped) для декоратора, который можно свернуть"""
+    if not isinstance(pizza, IDecorator) or not _affine_trusted(type(pizza)):
+        return None
+    affine = pizza.affine()
+    wrapped = pizza.wrapped()
+    if affine is None or wrapped is None:
+        return None
+    return affine, wrapped
+
+
+class CompiledPizza(IDecorator):
+    """
+    Стопка декораторов, свернутая в одно аффинное преобразование:
+    cost() = scale * inner.cost() + offset, где inner - основа пиццы или
+    первый декоратор, для которого affine() не определен или который
+    переопределяет cost() без affine(). Стоимость
+    считается за постоянное время независимо от глубины стопки.
+    Основа без декораторов сворачивается в scale = 1, offset = 0.
+    """
+
+    # имя свернутой пиццы, если у исходного объекта нет name()
+    default_name = 'Основа'
+
+    def __init__(self, pizza: IPizzaBase):
+        scale, offset = 1.0, 0.0
+        inner = pizza
+        while True:
+            step = _affine_step(inner)
+            if step is None:
+                break
+            (inner_scale, inner_offset), wrapped = step
+            offset += scale * inner_offset
+            scale *= inner_scale
+            inner = wrapped
+        self.scale = scale
+        self.offset = offset
+        self.inner = inner
+        name = getattr(pizza, 'name', None)
+        self.__name = name() if name is not None else self.default_name
+
+    def cost(self) -> float:
+        return self.scale * self.inner.cost() + self.offset
+
+    def name(self) -> str:
+        return self.__name
+
+    def wrapped(self) -> IPizzaBase:
+        return self.inner
+
+    def affine(self) -> Tuple[float, float]:
+        return self.scale, self.offset
+
+
+class PizzaRecipe:
+    """
+    Рецепт пиццы: пары (класс декоратора, стоимость), которые применяются
+    к основе по порядку - первым идет самый внутренний декоратор.
+    """
+
+    def __init__(self, steps: Iterable[Tuple[Type[IDecorator], float]]):
+        self.steps = tuple(steps)
+
+    def build(self, base: IPizzaBase) -> IPizzaBase:
+        pizza = base
+        for decorator, pizza_cost in self.steps:
+            pizza = decorator(pizza, pizza_cost)
+        return pizza
+
+    def price_many(self, base_costs: Iterable[float]) -> array:
+        """
+        Стоимости пицц по рецепту для набора стоимостей основы.
+        Если все декораторы рецепта аффинные, рецепт один раз сворачивается
+        в пару (scale, offset) и применяется ко всем стоимостям за один
+        проход. Иначе для каждой основы строится своя стопка декораторов.
+        """
+        probe = PizzaBase(0.0)
+        compiled = CompiledPizza(self.build(probe))
+        if compiled.inner is not probe:
+            return array(
+                'd',
+                (self.build(PizzaBase(it)).cost() for it in base_costs),
+            )
+        scale, offset = compiled.scale, compiled.offset
+        return array('d', [scale * it + offset for it in base_costs])
+
+
+class PizzaInterner:
+    """
+    Хранилище стопок декораторов без повторов (hash consing).
+    Одинаковые основы и одинаковые декораторы над одним и тем же объектом
+    создаются один раз, поэтому стопки с общим началом разделяют его.
+    Стоимость каждой стопки запоминается, так что общее начало многих
+    стопок считается только один раз.
+    """
+
+    def __init__(self):
+        self._pizzas = {}  # ключ -> объект стопки
+        self._costs = {}  # объект стопки -> стоимость
+
+    def base(self, cost: float) -> PizzaBase:
+        key = (PizzaBase, cost)
+        pizza = self._pizzas.get(key)
+        if pizza is None:
+            pizza = self._pizzas[key] = PizzaBase(cost)
+        return pizza
+
+    def decorate(
+        self,
+        decorator: Type[IDecorator],
+        wrapped: IPizzaBase,
+        pizza_cost: float,
+    ) -> IDecorator:
+        key = (decorator, wrapped, pizza_cost)
+        pizza = self._pizzas.get(key)
+        if pizza is None:
+            pizza = self._pizzas[key] = decorator(wrapped, pizza_cost)
+        return pizza
+
+    def build(self, recipe: PizzaRecipe, base_cost: float) -> IPizzaBase:
+        pizza = self.base(base_cost)
+        for decorator, pizza_cost in recipe.steps:
+            pizza = self.decorate(decorator, pizza, pizza_cost)
+        return pizza
+
+    def cost(self, pizza: IPizzaBase) -> float:
+        """
+        Стоимость стопки с запоминанием: спускаемся по стопке до первого
+        уже посчитанного объекта и считаем стоимости обратно вверх.
+        """
+        costs = self._costs
+        chain = []
+        it = pizza
+        while it not in costs:
+            chain.append(it)
+            step = _affine_step(it)
+            if step is None:
+                break
+            it = step[1]
+
+        for it in reversed(chain):
+            step = _affine_step(it)
+            if step is None:
+                costs[it] = it.cost()
+            else:
+                (scale, offset), wrapped = step
+                costs[it] = scale * costs[wrapped] + offset
+        return costs[pizza]
+
+
+class ComposedPizza(IDecorator):
+    """
+    Базовый класс пицц, сгенерированных PizzaRecipeRegistry.
+    Вся стопка декораторов рецепта заменяется одним объектом, а рецепт и
+    его свертка хранятся в атрибутах сгенерированного класса.
+    """
+
+    __slots__ = ('_wrapped',)
+
+    recipe: PizzaRecipe = PizzaRecipe(())
+    pizza_name: str = ''
+    # свертка рецепта; None, если в нем есть неаффинные декораторы
+    scale: Optional[float] = None
+    offset: Optional[float] = None
+
+    def __init__(self, wrapped: IPizzaBase):
+        self._wrapped = wrapped
+
+    def cost(self) -> float:
+        if self.scale is None:
+            return self.recipe.build(self._wrapped).cost()
+        return self.scale * self._wrapped.cost() + self.offset
+
+    def name(self) -> str:
+        return self.pizza_name
+
+    def wrapped(self) -> IPizzaBase:
+        return self._wrapped
+
+    def affine(self) -> Optional[Tuple[float, float]]:
+        if self.scale is None:
+            return None
+        return self.scale, self.offset
+
+
+class PizzaRecipeRegistry:
+    """
+    Реестр декораторов для пицц, описанных в конфигурации списком пар
+    (имя декоратора, стоимость). Для каждого рецепта один раз генерируется
+    класс-наследник ComposedPizza, который кешируется по рецепту, поэтому
+    пицца по рецепту создается одним объектом вместо стопки оберток.
+    """
+
+    def __init__(self):
+        self._decorators = {}  # имя -> класс декоратора
+        self._classes = {}  # рецепт -> сгенерированный класс
+
+    def register(self, name: str, decorator: Type[IDecorator]) -> None:
+        self._decorators[name] = decorator
+
+    def compose(
+        self, recipe: Iterable[Tuple[str, float]]
+    ) -> Type[ComposedPizza]:
+        # пары из конфигурации могут быть списками, ключ - кортеж кортежей
+        key = tuple(map(tuple, recipe))
+        cls = self._classes.get(key)
+        if cls is None:
+            cls = self._classes[key] = self._make_class(key)
+        return cls
+
+    def create(
+        self, base: IPizzaBase, recipe: Iterable[Tuple[str, float]]
+    ) -> ComposedPizza:
+        return self.compose(recipe)(base)
+
+    def _make_class(self, key: tuple) -> Type[ComposedPizza]:
+        if not key:
+            raise ValueError('Пустой рецепт')
+        recipe = PizzaRecipe(
+            (self._decorators[name], pizza_cost) for name, pizza_cost in key
+        )
+        probe = PizzaBase(0.0)
+        pizza = recipe.build(probe)
+        compiled = CompiledPizza(pizza)
+        affine = compiled.inner is probe
+        return type(
+            '_'.join(decorator.__name__ for decorator, _ in recipe.steps),
+            (ComposedPizza,),
+            {
+                '__slots__': (),
+                'recipe': recipe,
+                'pizza_name': pizza.name(),
+                'scale': compiled.scale if affine else None,
+                'offset': compiled.offset if affine else None,
+            },
+        )
+
 
 if __name__ == '__main__':
 
@@ -30,6 +30,23 @@
 
 """
 
+import marshal
+import multiprocessing
+import struct
+import weakref
+from array import array
+from collections import OrderedDict
+from functools import partial
+from hashlib import blake2b
+from itertools import islice, product
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock
+from typing import (
+    Iterable,
+    Iterator,
+    Optional,
+)
+
 
 class PizzaOrderFlyWeight:
     def __init__(self, shared_state):
@@ -53,29 +70,348 @@ class PizzaOrderContext:
 
 class FlyWeightFactory:
     def __init__(self):
-        self.flyweights = []
+        # разделяемое состояние -> приспособленец, поиск за O(1)
+        self.flyweights = {}
 
     def get_flyweight(self, shared_state) -> PizzaOrderFlyWeight:
+        flyweight = self.flyweights.get(shared_state)
+        if flyweight is None:
+            flyweight = PizzaOrderFlyWeight(shared_state)
+            self.flyweights[shared_state] = flyweight
+        return flyweight
 
-        flyweights = list(
-            filter(lambda x: x.shared_state == shared_state, self.flyweights)
-        )
-        if flyweights:
-            return flyweights[0]
+    @property
+    def total(self):
+        return len(self.flyweights)
+
+
+class WeakFlyWeightFactory(FlyWeightFactory):
+    """
+    Фабрика приспособленцев со слабыми ссылками.
+    Приспособленец удаляется из пула, как только на него не ссылается
+    ни один контекст. При заданном max_size фабрика дополнительно держит
+    сильные ссылки на max_size последних запрошенных приспособленцев (LRU),
+    чтобы часто используемые состояния не пересоздавались. Пока
+    приспособленец жив, он остается в пуле, поэтому на одно разделяемое
+    состояние всегда приходится один приспособленец.
+    evictions - число приспособленцев, удаленных из пула.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        super().__init__()
+        # разделяемое состояние -> слабая ссылка на приспособленца
+        self.flyweights = {}
+        # разделяемое состояние -> приспособленец, от старых к новым
+        self._recent = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_flyweight(self, shared_state) -> PizzaOrderFlyWeight:
+        ref = self.flyweights.get(shared_state)
+        flyweight = ref() if ref is not None else None
+        if flyweight is not None:
+            self.hits += 1
         else:
+            self.misses += 1
             flyweight = PizzaOrderFlyWeight(shared_state)
-            self.flyweights.append(flyweight)
+            self.flyweights[shared_state] = weakref.ref(
+                flyweight, partial(self._on_collect, shared_state)
+            )
+        self._touch(shared_state, flyweight)
+        return flyweight
+
+    def _touch(self, shared_state, flyweight: PizzaOrderFlyWeight):
+        """Переносит приспособленца в конец списка последних запрошенных"""
+        max_size = self.max_size
+        if max_size is None:
+            return
+        self._recent[shared_state] = flyweight
+        self._recent.move_to_end(shared_state)
+        while len(self._recent) > max_size:
+            self._recent.popitem(last=False)
+
+    def _on_collect(self, shared_state, ref):
+        # приспособленец собран сборщиком мусора - убираем его из пула,
+        # если за это время по ключу не был создан новый
+        if self.flyweights.get(shared_state) is ref:
+            del self.flyweights[shared_state]
+            self.evictions += 1
+
+
+class ConcurrentFlyWeightFactory(FlyWeightFactory):
+    """
+    Потокобезопасная фабрика приспособленцев.
+    Гарантирует один приспособленец на разделяемое состояние при вызовах из
+    нескольких потоков. Вместо одной глобальной блокировки используется
+    набор блокировок (lock striping): ключ блокирует только свою полосу,
+    выбранную по хешу, а уже созданные приспособленцы читаются без
+    блокировки.
+    """
+
+    def __init__(self, stripes: int = 64):
+        super().__init__()
+        self._locks = [Lock() for _ in range(stripes)]
+
+    def get_flyweight(self, shared_state) -> PizzaOrderFlyWeight:
+        flyweight = self.flyweights.get(shared_state)
+        if flyweight is not None:
             return flyweight
 
+        lock = self._locks[hash(shared_state) % len(self._locks)]
+        with lock:
+            # повторная проверка: другой поток мог успеть создать объект
+            flyweight = self.flyweights.get(shared_state)
+            if flyweight is None:
+                flyweight = PizzaOrderFlyWeight(shared_state)
+                self.flyweights[shared_state] = flyweight
+        return flyweight
+
+
+class SharedFlyWeightTable(FlyWeightFactory):
+    """
+    Таблица приспособленцев в разделяемой памяти.
+    Несколько процессов подключаются к одному сегменту по имени и получают
+    для одинакового разделяемого состояния один и тот же номер слота.
+    Состояние хранится в слоте в сериализованном через marshal виде,
+    поэтому оно должно состоять из встроенных типов (числа, строки,
+    кортежи). Слоты не освобождаются, ёмкость задается при создании.
+    Состояния сравниваются по сериализованным байтам, поэтому равные, но
+    разнотипные состояния (1, 1.0, True) получают разные слоты - одинаково
+    во всех процессах.
+
+    Таблицу передают воркерам через initargs пула процессов -
+    вместе с ней передается межпроцессная блокировка для вставки.
+    Блокировка создается в context - контексте multiprocessing, в котором
+    запускается пул (например, get_context('spawn')), по умолчанию - в
+    контексте по умолчанию.
+    """
+
+    _HEADER = struct.Struct('<QQQ')  # ёмкость, размер данных слота, занято
+    _SLOT_HEADER = struct.Struct('<QI')  # хеш состояния, длина данных
+
+    def __init__(
+        self,
+        capacity: int = 1024,
+        payload_size: int = 120,
+        name: Optional[str] = None,
+        lock=None,
+        context=None,
+    ):
+        super().__init__()
+        # локальные кеши процесса, ключ - сериализованное состояние
+        self._slot_ids = {}
+        self._slot_flyweights = {}
+        if lock is None:
+            if context is None:
+                context = multiprocessing.get_context()
+            lock = context.Lock()
+        self._lock = lock
+        if name is None:
+            self._owner = True
+            slot_size = self._SLOT_HEADER.size + payload_size
+            self._shm = SharedMemory(
+                create=True, size=self._HEADER.size + capacity * slot_size
+            )
+            self._HEADER.pack_into(self._shm.buf, 0, capacity, payload_size, 0)
+        else:
+            self._owner = False
+            self._shm = SharedMemory(name=name)
+        self.capacity, self.payload_size, _ = self._HEADER.unpack_from(
+            self._shm.buf, 0
+        )
+        self._slot_size = self._SLOT_HEADER.size + self.payload_size
+
+    def __reduce__(self):
+        return (
+            self.__class__,
+            (self.capacity, self.payload_size, self.name, self._lock),
+        )
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
     @property
     def total(self):
-        return len(self.flyweights)
+        return self._HEADER.unpack_from(self._shm.buf, 0)[2]
+
+    def _offset(self, slot: int) -> int:
+        return self._HEADER.size + slot * self._slot_size
+
+    def _probe(self, digest: int, payload: bytes):
+        """
+        Ищет слот с данным состоянием или первый свободный слот
+        (открытая адресация с линейным пробированием)
+        """
+        buf = self._shm.buf
+        start = digest % self.capacity
+        for step in range(self.capacity):
+            slot = (start + step) % self.capacity
+            offset = self._offset(slot)
+            slot_digest, length = self._SLOT_HEADER.unpack_from(buf, offset)
+            if slot_digest == 0:
+                return slot, False
+            if slot_digest == digest:
+                offset += self._SLOT_HEADER.size
+                if buf[offset:offset + length] == payload:
+                    return slot, True
+        raise OverflowError('Таблица приспособленцев заполнена')
+
+    @staticmethod
+    def _payload(shared_state) -> bytes:
+        # версия 2 формата marshal не использует ссылки внутри данных,
+        # поэтому одинаковые состояния всегда дают одинаковые байты
+        return marshal.dumps(shared_state, 2)
+
+    def get_slot(self, shared_state) -> int:
+        """Возвращает номер слота разделяемого состояния, создавая его"""
+        return self._get_slot(self._payload(shared_state))
+
+    def _get_slot(self, payload: bytes) -> int:
+        slot = self._slot_ids.get(payload)
+        if slot is not None:
+            return slot
+
+        if len(payload) > self.payload_size:
+            raise ValueError('Разделяемое состояние не помещается в слот')
+        digest = int.from_bytes(
+            blake2b(payload, digest_size=8).digest(), 'little'
+        ) or 1
+        slot, found = self._probe(digest, payload)
+        if not found:
+            with self._lock:
+                slot, found = self._probe(digest, payload)
+                if not found:
+                    buf = self._shm.buf
+                    offset = self._offset(slot)
+                    data_offset = offset + self._SLOT_HEADER.size
+                    buf[data_offset:data_offset + len(payload)] = payload
+                    # хеш пишется последним: после него слот считается занятым
+                    self._SLOT_HEADER.pack_into(
+                        buf, offset, digest, len(payload)
+                    )
+                    capacity, payload_size, count = self._HEADER.unpack_from(
+                        buf, 0
+                    )
+                    self._HEADER.pack_into(
+                        buf, 0, capacity, payload_size, count + 1
+                    )
+        self._slot_ids[payload] = slot
+        return slot
+
+    def get_flyweight_from_slot(self, slot: int) -> PizzaOrderFlyWeight:
+        """Восстанавливает приспособленца по номеру слота"""
+        flyweight = self._slot_flyweights.get(slot)
+        if flyweight is None:
+            offset = self._offset(slot)
+            digest, length = self._SLOT_HEADER.unpack_from(
+                self._shm.buf, offset
+            )
+            if digest == 0:
+                raise KeyError(slot)
+            offset += self._SLOT_HEADER.size
+            flyweight = PizzaOrderFlyWeight(
+                marshal.loads(self._shm.buf[offset:offset + length])
+            )
+            self._slot_flyweights[slot] = flyweight
+        return flyweight
+
+    def get_flyweight(self, shared_state) -> PizzaOrderFlyWeight:
+        payload = self._payload(shared_state)
+        flyweight = self.flyweights.get(payload)
+        if flyweight is None:
+            flyweight = self.get_flyweight_from_slot(self._get_slot(payload))
+            self.flyweights[payload] = flyweight
+        return flyweight
+
+    def close(self) -> None:
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class ColumnarPizzaOrderContexts:
+    """
+    Колоночное хранилище контекстов заказов.
+    Вместо объекта PizzaOrderContext на каждый заказ хранит два компактных
+    массива кодов: код уникального состояния и код приспособленца.
+    Одинаковые уникальные состояния хранятся один раз. При обращении по
+    индексу собирается представление контекста - новый PizzaOrderContext.
+    """
+
+    def __init__(self):
+        self._unique_states = []
+        self._unique_state_codes = {}
+        self._flyweights = []
+        self._flyweight_codes = {}
+        self.unique_state_codes = array('I')
+        self.flyweight_codes = array('I')
+
+    @staticmethod
+    def _intern(value, values: list, codes: dict) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = len(values)
+            values.append(value)
+            codes[value] = code
+        return code
+
+    def add(self, unique_state, flyweight: PizzaOrderFlyWeight) -> None:
+        self.unique_state_codes.append(
+            self._intern(
+                unique_state, self._unique_states, self._unique_state_codes
+            )
+        )
+        self.flyweight_codes.append(
+            self._intern(flyweight, self._flyweights, self._flyweight_codes)
+        )
+
+    def append(self, context: PizzaOrderContext) -> None:
+        self.add(context.unique_state, context.flyweight)
+
+    def extend(self, contexts: Iterable[PizzaOrderContext]) -> None:
+        for context in contexts:
+            self.add(context.unique_state, context.flyweight)
+
+    def __len__(self):
+        return len(self.flyweight_codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            unique_states = self._unique_states
+            flyweights = self._flyweights
+            return [
+                PizzaOrderContext(
+                    unique_states[unique_code], flyweights[flyweight_code]
+                )
+                for unique_code, flyweight_code in zip(
+                    self.unique_state_codes[index], self.flyweight_codes[index]
+                )
+            ]
+        return PizzaOrderContext(
+            self._unique_states[self.unique_state_codes[index]],
+            self._flyweights[self.flyweight_codes[index]],
+        )
+
+    def __iter__(self):
+        unique_states = self._unique_states
+        flyweights = self._flyweights
+        for unique_code, flyweight_code in zip(
+            self.unique_state_codes, self.flyweight_codes
+        ):
+            yield PizzaOrderContext(
+                unique_states[unique_code], flyweights[flyweight_code]
+            )
 
 
 class PizzaOrderMaker:
-    def __init__(self, flyweight_factory: FlyWeightFactory):
+    def __init__(self, flyweight_factory: FlyWeightFactory, contexts=None):
         self.flyweight_factory = flyweight_factory
-        self.contexts = []
+        # по умолчанию контексты хранятся списком объектов, для большого
+        # числа заказов можно передать ColumnarPizzaOrderContexts
+        self.contexts = [] if contexts is None else contexts
 
     def make_pizza_order(
         self, unique_state, shared_state
@@ -86,6 +422,42 @@ class PizzaOrderMaker:
 
         return context
 
+    def make_pizza_orders(
+        self,
+        orders: Iterable[tuple],
+        batch_size: int = 1024,
+        keep_contexts: bool = True,
+    ) -> Iterator[PizzaOrderContext]:
+        """
+        Потоковое оформление заказов.
+        Принимает итерируемый объект пар (уникальное состояние, разделяемое
+        состояние) и лениво возвращает контексты. Заказы читаются пачками
+        по batch_size, и приспособленец запрашивается у фабрики один раз на
+        каждое разделяемое состояние пачки. Контекст сохраняется в contexts
+        в момент выдачи, поэтому при досрочной остановке сохранены только
+        выданные заказы. При keep_contexts=False контексты не сохраняются,
+        и память не растет с числом заказов.
+        """
+        get_flyweight = self.flyweight_factory.get_flyweight
+        keep = self.contexts.append if keep_contexts else None
+        orders = iter(orders)
+        while True:
+            batch = list(islice(orders, batch_size))
+            if not batch:
+                return
+            flyweights = {}
+            for _, shared_state in batch:
+                if shared_state not in flyweights:
+                    flyweights[shared_state] = get_flyweight(shared_state)
+            for unique_state, shared_state in batch:
+                context = PizzaOrderContext(
+                    unique_state, flyweights[shared_state]
+                )
+                # контекст сохраняется только когда отдан вызывающему
+                if keep:
+                    keep(context)
+                yield context
+
 
 if __name__ == '__main__':
     flyweight_factory = FlyWeightFactory()
@@ -98,11 +470,9 @@ if __name__ == '__main__':
     ]
     unique_states = ['Маргарита', 'Салями', '4 сыра']
 
-    orders = [
-        pizza_maker.make_pizza_order(x, y)
-        for x in unique_states
-        for y in shared_states
-    ]
+    orders = list(
+        pizza_maker.make_pizza_orders(product(unique_states, shared_states))
+    )
 
     print('Количество созданных пицц:', len(orders))
     print('Количество разделяемых объектов:', flyweight_factory.total)
@@ -33,7 +33,35 @@ from abc import (
     ABC,
     abstractmethod,
 )
-from functools import partial
+import hashlib
+import mmap
+import copy
+import os
+import re
+import shutil
+import struct
+import zlib
+from array import array
+from collections import OrderedDict
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+)
+from threading import (
+    BoundedSemaphore,
+    Lock,
+)
+from typing import Optional
+
+# именованные цвета для изображений с пиксельным буфером
+COLORS = {
+    'black': (0, 0, 0),
+    'white': (255, 255, 255),
+    'gray': (128, 128, 128),
+    'red': (255, 0, 0),
+    'green': (0, 128, 0),
+    'blue': (0, 0, 255),
+}
 
 
 class ImageBase(ABC):
@@ -78,29 +106,687 @@ class Image(ImageBase):
         print('Сохраняем изображение в файл %s' % filename)
 
 
+class PixelImage(ImageBase):
+    """
+    Изображение с непрерывным буфером пикселей RGB.
+    Цвет задается именем из COLORS или кортежем (r, g, b).
+    """
+
+    def __init__(self, width, height):
+        self._width = int(width)
+        self._height = int(height)
+        self._pixels = bytearray(self._width * self._height * 3)
+
+    @staticmethod
+    def _rgb(color) -> bytes:
+        if isinstance(color, str):
+            color = COLORS[color]
+        return bytes(color)
+
+    def _offset(self, x, y) -> int:
+        if not (0 <= x < self._width and 0 <= y < self._height):
+            raise IndexError('Точка (%s, %s) вне изображения' % (x, y))
+        return (y * self._width + x) * 3
+
+    def draw(self, x, y, color):
+        offset = self._offset(x, y)
+        self._pixels[offset:offset + 3] = self._rgb(color)
+
+    def draw_many(self, xs, ys, colors):
+        """Рисует набор точек за один вызов"""
+        pixels = self._pixels
+        width = self._width
+        height = self._height
+        rgb_cache = {}
+        for x, y, color in zip(xs, ys, colors):
+            if not (0 <= x < width and 0 <= y < height):
+                raise IndexError('Точка (%s, %s) вне изображения' % (x, y))
+            # цвет может быть нехешируемым (например, списком), поэтому
+            # ключ кеша - id: все цвета живут в colors до конца вызова
+            rgb = rgb_cache.get(id(color))
+            if rgb is None:
+                rgb = rgb_cache[id(color)] = self._rgb(color)
+            offset = (y * width + x) * 3
+            pixels[offset:offset + 3] = rgb
+
+    def fill(self, color):
+        self._pixels[:] = self._rgb(color) * (self._width * self._height)
+
+    def save(self, filename):
+        """Сохраняет изображение в формате PPM или PNG по расширению файла"""
+        if filename.endswith('.ppm'):
+            writer = self._write_ppm
+        elif filename.endswith('.png'):
+            writer = self._write_png
+        else:
+            raise ValueError('Неизвестный формат файла %s' % filename)
+        with open(filename, 'wb') as file:
+            writer(file)
+
+    def _write_ppm(self, file):
+        file.write(b'P6 %d %d 255\n' % (self._width, self._height))
+        file.write(memoryview(self._pixels))
+
+    def _write_png(self, file):
+        def write_chunk(chunk_type: bytes, data: bytes):
+            file.write(struct.pack('>I', len(data)))
+            file.write(chunk_type)
+            file.write(data)
+            crc = zlib.crc32(data, zlib.crc32(chunk_type))
+            file.write(struct.pack('>I', crc))
+
+        pixels = memoryview(self._pixels)
+        row_size = self._width * 3
+        compressor = zlib.compressobj()
+        data = []
+        for offset in range(0, len(pixels), row_size):
+            # каждая строка PNG начинается с байта типа фильтра (0 - без)
+            data.append(compressor.compress(b'\x00'))
+            data.append(compressor.compress(pixels[offset:offset + row_size]))
+        data.append(compressor.flush())
+
+        file.write(b'\x89PNG\r\n\x1a\n')
+        write_chunk(
+            b'IHDR',
+            struct.pack('>IIBBBBB', self._width, self._height, 8, 2, 0, 0, 0),
+        )
+        write_chunk(b'IDAT', b''.join(data))
+        write_chunk(b'IEND', b'')
+
+
+class TiledImage(ImageBase):
+    """
+    Изображение в файле PPM, отображенном в память (mmap) и разбитом на
+    квадратные плитки. Плитка читается в память при первом рисовании в
+    ней, в памяти держится не более max_tiles плиток. На диск записываются
+    только измененные плитки - при вытеснении и при сохранении.
+    Поэтому расход памяти зависит от рабочей области, а не от размера
+    изображения.
+    Файл path создается заново; при reuse=True существующий файл
+    используется как исходный холст, если его заголовок и размер
+    совпадают с размерами изображения, иначе возбуждается ValueError.
+    """
+
+    def __init__(
+        self, width, height, path, tile_size=256, max_tiles=64, reuse=False
+    ):
+        self._width = int(width)
+        self._height = int(height)
+        self._path = path
+        self._tile_size = int(tile_size)
+        if max_tiles < 1:
+            raise ValueError('В памяти должна помещаться хотя бы одна плитка')
+        self._max_tiles = max_tiles
+        self._tiles = OrderedDict()  # (номер столбца, номер строки) -> байты
+        self._dirty = set()
+
+        header = b'P6 %d %d 255\n' % (self._width, self._height)
+        self._data_offset = len(header)
+        size = len(header) + self._width * self._height * 3
+        if reuse and os.path.exists(path):
+            with open(path, 'rb') as file:
+                if file.read(len(header)) != header:
+                    raise ValueError('Файл %s - другой холст' % path)
+            if os.path.getsize(path) != size:
+                raise ValueError('Размер файла %s не совпадает' % path)
+        else:
+            with open(path, 'wb') as file:
+                file.write(header)
+                # файл создается разреженным, место выделяется по мере записи
+                file.truncate(size)
+        self._file = open(path, 'r+b')
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+
+    def _tile_rows(self, key):
+        """Смещения строк плитки в файле, ширина строки плитки в байтах"""
+        column, row = key
+        x = column * self._tile_size
+        y = row * self._tile_size
+        row_size = (min(self._width, x + self._tile_size) - x) * 3
+        offsets = [
+            self._data_offset + (line * self._width + x) * 3
+            for line in range(y, min(self._height, y + self._tile_size))
+        ]
+        return offsets, row_size
+
+    def _tile(self, key) -> bytearray:
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            return tile
+
+        offsets, row_size = self._tile_rows(key)
+        tile = bytearray()
+        for offset in offsets:
+            tile += self._mmap[offset:offset + row_size]
+        self._tiles[key] = tile
+        if len(self._tiles) > self._max_tiles:
+            old_key, old_tile = self._tiles.popitem(last=False)
+            if old_key in self._dirty:
+                self._write_tile(old_key, old_tile)
+        return tile
+
+    def _write_tile(self, key, tile: bytearray):
+        offsets, row_size = self._tile_rows(key)
+        view = memoryview(tile)
+        for index, offset in enumerate(offsets):
+            start = index * row_size
+            self._mmap[offset:offset + row_size] = view[
+                start:start + row_size
+            ]
+        self._dirty.discard(key)
+
+    def draw(self, x, y, color):
+        self.draw_many((x,), (y,), (color,))
+
+    def draw_many(self, xs, ys, colors):
+        """Рисует набор точек за один вызов"""
+        tile_size = self._tile_size
+        width = self._width
+        height = self._height
+        rgb_cache = {}
+        for x, y, color in zip(xs, ys, colors):
+            if not (0 <= x < width and 0 <= y < height):
+                raise IndexError('Точка (%s, %s) вне изображения' % (x, y))
+            # цвет может быть нехешируемым (например, списком), поэтому
+            # ключ кеша - id: все цвета живут в colors до конца вызова
+            rgb = rgb_cache.get(id(color))
+            if rgb is None:
+                rgb = rgb_cache[id(color)] = PixelImage._rgb(color)
+            key = (x // tile_size, y // tile_size)
+            tile = self._tile(key)
+            self._dirty.add(key)
+            tile_width = min(width - key[0] * tile_size, tile_size)
+            offset = ((y % tile_size) * tile_width + x % tile_size) * 3
+            tile[offset:offset + 3] = rgb
+
+    def fill(self, color):
+        # заливка меняет все изображение, поэтому пишется сразу в файл
+        # построчно, загруженные плитки становятся неактуальными
+        self._tiles.clear()
+        self._dirty.clear()
+        line = PixelImage._rgb(color) * self._width
+        for y in range(self._height):
+            offset = self._data_offset + y * len(line)
+            self._mmap[offset:offset + len(line)] = line
+
+    def save(self, filename):
+        """Сохраняет изображение в формате PPM"""
+        if not filename.endswith('.ppm'):
+            raise ValueError('Неизвестный формат файла %s' % filename)
+        for key in list(self._dirty):
+            self._write_tile(key, self._tiles[key])
+        self._mmap.flush()
+        if os.path.abspath(filename) != os.path.abspath(self._path):
+            shutil.copyfile(self._path, filename)
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
 class ImageProxy(ImageBase):
     """
     Заместитель изображения.
     Откладывает выполнение операций над изображением до момента его сохранения.
+    Само изображение создается только при сохранении или первом обращении.
     """
 
+    image_class = Image
+
+    # коды операций в журнале
+    DRAW = 0
+    FILL = 1
+
     def __init__(self, *args, **kwargs):
-        self._image = Image(*args, **kwargs)
-        self.operations = []
+        self._args = args
+        self._kwargs = kwargs
+        self._image = None
+        self._reset_log()
+
+    def _reset_log(self):
+        # журнал операций хранится параллельными массивами:
+        # код операции, координаты точки и номер цвета в таблице цветов
+        self._opcodes = array('B')
+        self._xs = array('i')
+        self._ys = array('i')
+        self._color_codes = array('I')
+        self._colors = []
+        self._color_index = {}
+
+    def _record(self, opcode, x, y, color):
+        try:
+            code = self._color_index.get(color)
+        except TypeError:
+            # нехешируемый цвет (например, список) хранится без объединения
+            code = len(self._colors)
+            self._colors.append(color)
+        else:
+            if code is None:
+                code = self._color_index[color] = len(self._colors)
+                self._colors.append(color)
+        self._append_point(x, y)
+        self._opcodes.append(opcode)
+        self._color_codes.append(code)
+
+    def _append_point(self, x, y):
+        try:
+            self._xs.append(x)
+            try:
+                self._ys.append(y)
+            except BaseException:
+                self._xs.pop()
+                raise
+        except (TypeError, OverflowError):
+            # координаты не помещаются в int: столбцы журнала становятся
+            # списками и принимают любые значения
+            self._xs = list(self._xs)
+            self._ys = list(self._ys)
+            self._xs.append(x)
+            self._ys.append(y)
+
+    @property
+    def image(self) -> ImageBase:
+        """Реальное изображение, создается при первом обращении"""
+        if self._image is None:
+            self._image = self.image_class(*self._args, **self._kwargs)
+        return self._image
+
+    @property
+    def operations(self) -> list:
+        """Журнал операций в виде пар (имя метода, аргументы)"""
+        colors = self._colors
+        return [
+            ('fill', (colors[code],))
+            if opcode == self.FILL
+            else ('draw', (x, y, colors[code]))
+            for opcode, x, y, code in zip(
+                self._opcodes, self._xs, self._ys, self._color_codes
+            )
+        ]
+
+    @property
+    def bytes_per_operation(self) -> float:
+        """Объем памяти журнала в расчете на одну операцию"""
+        count = len(self._opcodes)
+        if not count:
+            return 0.0
+        size = sum(
+            len(it) * (
+                it.itemsize if isinstance(it, array) else struct.calcsize('P')
+            )
+            for it in (self._opcodes, self._xs, self._ys, self._color_codes)
+        )
+        return size / count
+
+    def draw(self, x, y, color):
+        """
+        Записывает рисование точки в журнал. Целые координаты хранятся в
+        массивах int; после первой нецелой координаты (например, float)
+        журнал хранит координаты списками. Проверяет координаты и цвет
+        само изображение при сохранении.
+        """
+        self._record(self.DRAW, x, y, color)
+
+    def fill(self, color):
+        self._record(self.FILL, 0, 0, color)
+
+    def discard(self):
+        """Освобождает журнал операций и созданное изображение"""
+        self._reset_log()
+        close = getattr(self._image, 'close', None)
+        if close is not None:
+            close()
+        self._image = None
 
-    def draw(self, *args):
-        func = partial(self._image.draw, *args)
-        self.operations.append(func)
+    def compact(self) -> int:
+        """
+        Сжимает журнал операций: отбрасывает всё, что было сделано до
+        последней заливки, и оставляет только последнее рисование каждой
+        точки. Возвращает количество удаленных операций.
+        """
+        count = len(self._opcodes)
+        # после последней заливки в журнале остаются только рисования
+        fill_index = self._opcodes.tobytes().rfind(bytes((self.FILL,)))
+        first_draw = fill_index + 1
+        # для каждой точки запоминается индекс ее последнего рисования
+        try:
+            last_draws = {
+                pixel: index
+                for index, pixel in enumerate(
+                    zip(self._xs[first_draw:], self._ys[first_draw:]),
+                    first_draw,
+                )
+            }
+        except TypeError:
+            # нехешируемые координаты: журнал остается без изменений
+            return 0
+        kept_count = len(last_draws) + (fill_index >= 0)
+        if kept_count == count:
+            return 0
 
-    def fill(self, *args):
-        func = partial(self._image.fill, *args)
-        self.operations.append(func)
+        kept = sorted(last_draws.values())
+        if fill_index >= 0:
+            kept.insert(0, fill_index)
+        for name in ('_opcodes', '_xs', '_ys', '_color_codes'):
+            column = getattr(self, name)
+            compacted = list(map(column.__getitem__, kept))
+            if isinstance(column, array):
+                compacted = array(column.typecode, compacted)
+            setattr(self, name, compacted)
+        return count - kept_count
 
     def save(self, filename):
+        image = self.image
+        self.compact()
         # выполняем все операции над изображением
-        [func() for func in self.operations]
+        self._replay(image)
         # сохраняем изображение
-        self._image.save(filename)
+        image.save(filename)
+
+    def save_async(
+        self,
+        filename,
+        saver: Optional['ImageSaver'] = None,
+        timeout: Optional[float] = None,
+    ) -> Future:
+        """
+        Сохраняет изображение в фоне и возвращает Future.
+        Сохраняется снимок журнала на момент вызова: последующие операции
+        над заместителем в файл не попадают.
+        Если очередь сохранений заполнена, вызов блокируется (см.
+        ImageSaver.submit). В asyncio результат можно ожидать через
+        asyncio.wrap_future, но вызывать save_async следует с timeout=0,
+        чтобы переполнение давало TimeoutError, а не останавливало цикл
+        событий.
+        """
+        if saver is None:
+            saver = ImageSaver.default()
+        return saver.submit(self._snapshot(), filename, timeout)
+
+    def _snapshot(self) -> 'ImageProxy':
+        """
+        Копия заместителя с собственным журналом операций. Изображение
+        снимок создает свое, чтобы не рисовать на изображении заместителя.
+        """
+        snapshot = copy.copy(self)
+        snapshot._image = None
+        for name in ('_opcodes', '_xs', '_ys', '_color_codes'):
+            setattr(snapshot, name, getattr(self, name)[:])
+        snapshot._colors = self._colors[:]
+        snapshot._color_index = self._color_index.copy()
+        return snapshot
+
+    def _replay(self, image: ImageBase):
+        """
+        Выполняет операции журнала. Если изображение умеет рисовать набор
+        точек за раз (draw_many), идущие подряд рисования передаются ему
+        срезами массивов журнала.
+        """
+        draw_many = getattr(image, 'draw_many', None)
+        opcodes = self._opcodes.tobytes()
+        xs, ys, color_codes = self._xs, self._ys, self._color_codes
+        colors = self._colors
+        fill_opcode = bytes((self.FILL,))
+        index = 0
+        while index < len(opcodes):
+            if opcodes[index] == self.FILL:
+                image.fill(colors[color_codes[index]])
+                index += 1
+                continue
+            end = opcodes.find(fill_opcode, index)
+            if end == -1:
+                end = len(opcodes)
+            run_colors = [colors[code] for code in color_codes[index:end]]
+            if draw_many is not None:
+                draw_many(xs[index:end], ys[index:end], run_colors)
+            else:
+                for x, y, color in zip(
+                    xs[index:end], ys[index:end], run_colors
+                ):
+                    image.draw(x, y, color)
+            index = end
+
+
+class ImageSaver:
+    """
+    Фоновое сохранение изображений на ограниченном пуле потоков.
+    Одновременно принимается не более max_pending сохранений: при
+    переполнении submit блокирует вызывающий поток, пока одно из
+    сохранений не завершится, или возбуждает TimeoutError по истечении
+    timeout секунд (timeout=0 - без ожидания).
+    """
+
+    _default = None
+    _default_lock = Lock()
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 64):
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._pending = BoundedSemaphore(max_pending)
+
+    @classmethod
+    def default(cls) -> 'ImageSaver':
+        """Общий для всех заместителей экземпляр с настройками по умолчанию"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+        return cls._default
+
+    def submit(
+        self, proxy: ImageBase, filename, timeout: Optional[float] = None
+    ) -> Future:
+        if not self._pending.acquire(timeout=timeout):
+            raise TimeoutError('Очередь сохранений заполнена')
+        try:
+            future = self._executor.submit(proxy.save, filename)
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait)
+
+
+class PixelImageProxy(ImageProxy):
+    """Заместитель изображения с пиксельным буфером"""
+
+    image_class = PixelImage
+
+
+class TiledImageProxy(ImageProxy):
+    """
+    Заместитель изображения, которое больше оперативной памяти.
+    Холст хранится в файле path и разбит на плитки tile_size x tile_size.
+    Фоновое сохранение (save_async) рисует не на этом холсте, а на новом
+    холсте в файле сохранения, поэтому поддерживает только формат PPM.
+    """
+
+    image_class = TiledImage
+    # снимок save_async рисует прямо в файл сохранения
+    _renders_to_target = False
+
+    def __init__(
+        self, width, height, path, tile_size=256, max_tiles=64, reuse=False
+    ):
+        super().__init__(width, height, path, tile_size, max_tiles, reuse)
+
+    def close(self):
+        """
+        Закрывает файл холста. Журнал операций сохраняется, поэтому
+        следующее сохранение создаст холст заново.
+        """
+        if self._image is not None:
+            self._image.close()
+            self._image = None
+
+    def save(self, filename):
+        if not self._renders_to_target:
+            return super().save(filename)
+        # снимок save_async рисует на собственном холсте прямо в файле
+        # сохранения: общий холст заместителя не защищен от
+        # одновременного рисования, а чужие точки попали бы в файл
+        if not filename.endswith('.ppm'):
+            raise ValueError('Неизвестный формат файла %s' % filename)
+        width, height, path, *options = self._args
+        if os.path.abspath(filename) == os.path.abspath(path):
+            raise ValueError('Файл %s - холст заместителя' % filename)
+        self._args = (width, height, filename, *options[:-1], False)
+        try:
+            super().save(filename)
+        finally:
+            self.close()
+
+    def _snapshot(self) -> 'ImageProxy':
+        snapshot = super()._snapshot()
+        snapshot._renders_to_target = True
+        return snapshot
+
+
+class RenderCache:
+    """
+    Кеш готовых изображений с адресацией по содержимому.
+    Хранит байты сохраненных файлов по ключу - хешу операций.
+    В памяти размер кеша ограничен max_bytes, при заданном directory
+    изображения дополнительно хранятся на диске в пределах max_disk_bytes.
+    При переполнении вытесняются давно не запрашиваемые изображения (LRU).
+    Ключ - шестнадцатеричный хеш sha256, он же имя файла в directory;
+    остальные файлы каталога кеш не трогает.
+    Кеш можно использовать из нескольких потоков, например из фоновых
+    сохранений ImageSaver.
+    """
+
+    _KEY_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        directory: Optional[str] = None,
+        max_disk_bytes: int = 1024 * 1024 * 1024,
+    ):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()  # ключ -> байты изображения
+        self._disk = OrderedDict()  # ключ -> размер файла
+        self.bytes_stored = 0
+        self.disk_bytes_stored = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            entries = sorted(
+                (
+                    entry
+                    for entry in os.scandir(directory)
+                    if self._KEY_PATTERN.fullmatch(entry.name)
+                    and entry.is_file(follow_symlinks=False)
+                ),
+                key=lambda it: it.stat().st_mtime,
+            )
+            for entry in entries:
+                self._disk[entry.name] = entry.stat().st_size
+                self.disk_bytes_stored += entry.stat().st_size
+            self._trim_disk()
+
+    @property
+    def hit_ratio(self) -> float:
+        with self._lock:
+            requests = self.hits + self.misses
+            return self.hits / requests if requests else 0.0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            elif key in self._disk:
+                with open(os.path.join(self.directory, key), 'rb') as file:
+                    data = file.read()
+                self._disk.move_to_end(key)
+                self._put_memory(key, data)
+
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if not self._KEY_PATTERN.fullmatch(key):
+            raise ValueError('Недопустимый ключ кеша %s' % key)
+        with self._lock:
+            self._put_memory(key, data)
+            if self.directory is not None and key not in self._disk:
+                with open(os.path.join(self.directory, key), 'wb') as file:
+                    file.write(data)
+                self._disk[key] = len(data)
+                self.disk_bytes_stored += len(data)
+                self._trim_disk()
+
+    def _trim_disk(self) -> None:
+        while self.disk_bytes_stored > self.max_disk_bytes:
+            old_key, size = self._disk.popitem(last=False)
+            os.remove(os.path.join(self.directory, old_key))
+            self.disk_bytes_stored -= size
+
+    def _put_memory(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        old_data = self._memory.pop(key, None)
+        if old_data is not None:
+            self.bytes_stored -= len(old_data)
+        self._memory[key] = data
+        self.bytes_stored += len(data)
+        while self.bytes_stored > self.max_bytes:
+            _, old_data = self._memory.popitem(last=False)
+            self.bytes_stored -= len(old_data)
+
+
+class CachingImageProxy(PixelImageProxy):
+    """
+    Кеширующий заместитель изображения.
+    Одинаковые по содержимому изображения (те же размеры, формат и
+    операции после нормализации журнала) берутся из кеша, а не рисуются
+    заново. Реальное изображение при попадании в кеш не создается.
+    """
+
+    def __init__(self, width, height, cache: RenderCache):
+        super().__init__(width, height)
+        self.cache = cache
+
+    def _normalized_operations(self) -> list:
+        """
+        Журнал после сжатия: последняя заливка и рисования точек,
+        упорядоченные по координатам - после сжатия каждая точка
+        рисуется один раз, поэтому порядок рисований не важен.
+        """
+        self.compact()
+        fills = [it for it in self.operations if it[0] == 'fill']
+        draws = [it for it in self.operations if it[0] == 'draw']
+        draws.sort(key=lambda it: it[1][:2])
+        return fills + draws
+
+    def render_key(self, filename) -> str:
+        digest = hashlib.sha256()
+        extension = os.path.splitext(filename)[1]
+        digest.update(repr((self._args, self._kwargs, extension)).encode())
+        for operation in self._normalized_operations():
+            digest.update(repr(operation).encode())
+        return digest.hexdigest()
+
+    def save(self, filename):
+        key = self.render_key(filename)
+        data = self.cache.get(key)
+        if data is None:
+            super().save(filename)
+            with open(filename, 'rb') as file:
+                self.cache.put(key, file.read())
+        else:
+            with open(filename, 'wb') as file:
+                file.write(data)
 
 
 if __name__ == '__main__':